@@ -1,16 +1,221 @@
 
-import base64
-import io
-import json
-from flask import Flask, request, jsonify
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request
 from flask_cors import CORS
 import cv2
 import numpy as np
-from PIL import Image
+import orjson
+import pybase64
 
 app = Flask(__name__)
 CORS(app)  # Allow cross-origin requests
 
+# Run the per-pixel filter stage through OpenCV's OpenCL T-API when asked to
+# and a device is available; contour finding and drawing stay on the CPU.
+# The OpenCL runtime is not fork-safe, so it is only probed on first use in
+# each process rather than at import (which may happen in gunicorn's master)
+OPENCL_REQUESTED = os.environ.get('CONTOUR_USE_OPENCL') == '1'
+_opencl_lock = threading.Lock()
+_opencl_pid = None
+_opencl_enabled = False
+
+def use_opencl():
+    """Return whether OpenCL is in use, initializing it once per process."""
+    global _opencl_pid, _opencl_enabled
+    if not OPENCL_REQUESTED:
+        return False
+    with _opencl_lock:
+        if _opencl_pid != os.getpid():
+            _opencl_enabled = cv2.ocl.haveOpenCL()
+            cv2.ocl.setUseOpenCL(_opencl_enabled)
+            _opencl_pid = os.getpid()
+        return _opencl_enabled
+
+# Per-thread scratch buffers reused across requests to avoid reallocating
+# full-size images on every call
+_scratch = threading.local()
+
+def get_scratch(name, shape, dtype=np.uint8):
+    """Return a reusable per-thread buffer, reallocating only when the shape changes."""
+    buf = getattr(_scratch, name, None)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = np.empty(shape, dtype=dtype)
+        setattr(_scratch, name, buf)
+    return buf
+
+DATA_URL_JPEG = 'data:image/jpeg;base64,'
+DATA_URL_PNG = 'data:image/png;base64,'
+
+# Encoder settings per output format: JPEG for the natural-image
+# visualizations, lossless single-channel PNG with the fastest compression
+# level for the grayscale one, and 1-bit PNG for the binary threshold
+IMAGE_FORMATS = {
+    'jpg': ('.jpg', DATA_URL_JPEG, [int(cv2.IMWRITE_JPEG_QUALITY), 80]),
+    'png': ('.png', DATA_URL_PNG, [int(cv2.IMWRITE_PNG_COMPRESSION), 1]),
+    'png-bilevel': ('.png', DATA_URL_PNG,
+                    [int(cv2.IMWRITE_PNG_COMPRESSION), 1, int(cv2.IMWRITE_PNG_BILEVEL), 1]),
+}
+
+def json_response(payload, status=200):
+    """Serialize a payload with orjson, passing NumPy arrays through natively."""
+    return Response(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY),
+                    status=status, mimetype='application/json')
+
+# Pool for visualization encoding, sized so every concurrent request thread
+# can encode its six visualizations at once. It is bounded per process
+# rather than by CPU count, since gunicorn runs one pool per worker. It
+# starts no threads until first use, so it is safe to create before forking
+REQUEST_THREADS = int(os.environ.get('CONTOUR_THREADS', 4))
+_encode_pool = ThreadPoolExecutor(max_workers=REQUEST_THREADS * 6)
+
+def encode_image(img, fmt='jpg'):
+    """Encode an image in the given format, returning its data URL prefix and bytes."""
+    ext, prefix, params = IMAGE_FORMATS[fmt]
+    is_success, buffer = cv2.imencode(ext, img, params)
+    if not is_success:
+        return None
+    return prefix, buffer
+
+# Base64 maps every 3 input bytes to 4 output characters, so slices that are
+# a multiple of 3 bytes long can be encoded independently and concatenated
+BASE64_CHUNK_SIZE = 3 * 64 * 1024
+
+def iter_base64(buffer):
+    """Yield the base64 encoding of a buffer in chunks."""
+    view = memoryview(buffer.reshape(-1))
+    for start in range(0, len(view), BASE64_CHUNK_SIZE):
+        yield pybase64.b64encode(view[start:start + BASE64_CHUNK_SIZE])
+
+def stream_detection(payload):
+    """Yield the detect_contours JSON body piece by piece.
+
+    Each encoded visualization is written out as a data URL while it is
+    base64-encoded, so the full response is never held in memory at once.
+    """
+    yield b'{"contours":' + orjson.dumps(payload['contours'], option=orjson.OPT_SERIALIZE_NUMPY)
+    yield b',"count":' + orjson.dumps(payload['count']) + b',"visualizations":{'
+    for i, (name, encoded) in enumerate(payload['visualizations'].items()):
+        yield (b',' if i else b'') + orjson.dumps(name) + b':'
+        if encoded is None or isinstance(encoded, str):
+            yield orjson.dumps(encoded)
+            continue
+        prefix, buffer = encoded
+        yield b'"' + prefix.encode()
+        yield from iter_base64(buffer)
+        yield b'"'
+    yield b'}}'
+
+def threshold_image(img):
+    """Return the grayscale and inverted adaptive-threshold images for a BGR image."""
+    if use_opencl():
+        # Upload once, run both filters on the device and download the results
+        gray = cv2.cvtColor(cv2.UMat(img), cv2.COLOR_BGR2GRAY)
+        thresh = cv2.adaptiveThreshold(
+            gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 21, 5)
+        return gray.get(), thresh.get()
+    
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY, dst=get_scratch('gray', img.shape[:2]))
+    
+    # Apply adaptive threshold; the mean variant uses a box filter, which is
+    # much cheaper than the Gaussian window for the same block size
+    thresh = cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 21, 5,
+        dst=get_scratch('thresh', img.shape[:2]))
+    return gray, thresh
+
+def pack_contours(contours):
+    """Pack contours into one (N, 2) point array plus CSR-style offsets.
+
+    Contour i spans points[offsets[i]:offsets[i + 1]]; both arrays are
+    serialized by orjson without creating any per-point Python objects.
+    """
+    offsets = np.zeros(len(contours) + 1, dtype=np.int64)
+    if not contours:
+        return {'offsets': offsets, 'points': np.empty((0, 2), dtype=np.int32)}
+    np.cumsum([len(contour) for contour in contours], out=offsets[1:])
+    return {'offsets': offsets, 'points': np.concatenate(contours).reshape(-1, 2)}
+
+def process_image(image_data):
+    """Run the contour pipeline on a base64 image.
+
+    Returns the response payload with each visualization as an encoded
+    (data URL prefix, bytes) pair, or a ready-made data URL string for the
+    passed-through original, ready for stream_detection.
+    """
+    # Keep the client's image data URL so it can be returned as the original
+    # as-is; anything else is re-encoded so the original is always valid
+    original_data_url = image_data if image_data.startswith('data:image/') else None
+    
+    # Decode base64 image
+    image_data = image_data.split(',')[1] if ',' in image_data else image_data
+    decoded_image = pybase64.b64decode(image_data, validate=False)
+    
+    # Decode straight into a BGR uint8 array, as OpenCV expects
+    img = cv2.imdecode(np.frombuffer(decoded_image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError('Could not decode image data')
+    
+    # The decoded image is never modified, so use it directly as the original
+    original = img
+    shape = original.shape
+    
+    # Convert to grayscale and threshold
+    gray, thresh = threshold_image(img)
+    
+    # Find contours using RETR_TREE for all contours including nested
+    contours_tree, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    
+    # Create detected_contours visualization (green filled contours)
+    detected_contours = get_scratch('detected', shape)
+    np.copyto(detected_contours, original)
+    cv2.drawContours(detected_contours, contours_tree, -1, (0, 255, 0), -1)
+    
+    # Find external contours
+    contours_external, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    
+    # Rasterize the external contours once into a single-channel mask
+    mask = get_scratch('mask', shape[:2])
+    mask.fill(0)
+    cv2.drawContours(mask, contours_external, -1, 255, cv2.FILLED)
+    
+    # Create highlight visualization (colored contours with aqua color)
+    highlight = get_scratch('highlight', shape)
+    highlight.fill(255)  # White background
+    highlight[mask != 0] = (0, 200, 175)
+    
+    # Extract foreground; pixels outside the mask are left untouched by
+    # bitwise_and, so the destination is cleared first
+    foreground = get_scratch('foreground', shape)
+    foreground.fill(0)
+    cv2.bitwise_and(original, original, dst=foreground, mask=mask)
+    
+    # Encode the visualizations in parallel; imencode releases the GIL and
+    # every call writes to its own output buffer
+    images = {
+        'detected_contours': (detected_contours, 'jpg'),
+        'color_contours': (highlight, 'jpg'),
+        'extract_contours': (foreground, 'jpg'),
+        'grayscale': (gray, 'png'),
+        'threshold': (thresh, 'png-bilevel')
+    }
+    # The original is unchanged, so only encode it when the client did not
+    # send an image data URL
+    if original_data_url is None:
+        images['original'] = (original, 'jpg')
+    futures = {name: _encode_pool.submit(encode_image, im, fmt) for name, (im, fmt) in images.items()}
+    
+    visualizations = {'original': original_data_url}
+    visualizations.update((name, future.result()) for name, future in futures.items())
+    
+    payload = {
+        'contours': pack_contours(contours_external),
+        'count': len(contours_external),
+        'visualizations': visualizations
+    }
+    return payload
+
 @app.route('/api/detect_contours', methods=['POST'])
 def detect_contours():
     # Get image data and parameters from the request
@@ -18,110 +223,35 @@ def detect_contours():
     image_data = data.get('image')
     
     try:
-        # Decode base64 image
-        image_data = image_data.split(',')[1] if ',' in image_data else image_data
-        decoded_image = base64.b64decode(image_data)
-        image = np.array(Image.open(io.BytesIO(decoded_image)))
-        
-        # Convert to RGB if in BGR format
-        if len(image.shape) > 2 and image.shape[2] == 3:
-            img = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        else:
-            img = image
-            
-        # Create a copy of the original image
-        original = img.copy()
-        
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if len(img.shape) > 2 else img
-            
-        # Apply adaptive threshold as in the sample code
-        thresh = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 21, 5)
-        
-        # Find contours using RETR_TREE for all contours including nested
-        contours_tree, _ = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # Create detected_contours visualization (green filled contours)
-        detected_contours = original.copy()
-        cv2.drawContours(detected_contours, contours_tree, -1, (0, 255, 0), -1)
-        
-        # Find external contours
-        contours_external, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        # Create highlight visualization (colored contours with aqua color)
-        highlight = np.ones_like(original) * 255  # White background
-        cv2.drawContours(highlight, contours_external, -1, (0, 200, 175), cv2.FILLED)
-        
-        # Create mask and extract foreground
-        mask = np.zeros_like(original)
-        cv2.drawContours(mask, contours_external, -1, (255, 255, 255), cv2.FILLED)
-        foreground = cv2.bitwise_and(original, mask)
-        
-        # Convert all visualization images to base64
-        def img_to_base64(img):
-            is_success, buffer = cv2.imencode('.png', img)
-            if not is_success:
-                return None
-            return f'data:image/png;base64,{base64.b64encode(buffer).decode("utf-8")}'
-        
-        # Convert numpy serializable contour format for the response
-        serialized_contours = []
-        for contour in contours_external:
-            points = []
-            for point in contour:
-                x, y = point[0]
-                points.append({"x": int(x), "y": int(y)})
-            serialized_contours.append({
-                "points": points,
-                "closed": True
-            })
-        
-        return jsonify({
-            'contours': serialized_contours,
-            'count': len(serialized_contours),
-            'visualizations': {
-                'original': img_to_base64(original),
-                'detected_contours': img_to_base64(detected_contours),
-                'color_contours': img_to_base64(highlight),
-                'extract_contours': img_to_base64(foreground),
-                'grayscale': img_to_base64(gray),
-                'threshold': img_to_base64(thresh)
-            }
-        })
-        
+        payload = process_image(image_data)
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
+    
+    return Response(stream_detection(payload), mimetype='application/json')
+
+MEDICAL_SAMPLES = [
+    {'id': 'brain-mri', 'name': 'Brain MRI', 'category': 'medical'},
+    {'id': 'lung-ct', 'name': 'Lung CT Scan', 'category': 'medical'},
+    {'id': 'liver-ultrasound', 'name': 'Liver Ultrasound', 'category': 'medical'},
+    {'id': 'retina-scan', 'name': 'Retina Scan', 'category': 'medical'}
+]
 
 @app.route('/api/medical_samples', methods=['GET'])
 def get_medical_samples():
     """Return a list of medical sample images for contour detection."""
-    sample_files = [
-        {'id': 'brain-mri', 'name': 'Brain MRI', 'category': 'medical'},
-        {'id': 'lung-ct', 'name': 'Lung CT Scan', 'category': 'medical'},
-        {'id': 'liver-ultrasound', 'name': 'Liver Ultrasound', 'category': 'medical'},
-        {'id': 'retina-scan', 'name': 'Retina Scan', 'category': 'medical'}
-    ]
-    
-    return jsonify({'samples': sample_files})
+    return json_response({'samples': MEDICAL_SAMPLES})
 
 @app.route('/api/sample/<sample_id>', methods=['GET'])
 def get_sample(sample_id):
     """Return base64 sample image data by ID."""
-    samples = {
-        'brain-mri': load_medical_sample('brain-mri'),
-        'lung-ct': load_medical_sample('lung-ct'),
-        'liver-ultrasound': load_medical_sample('liver-ultrasound'),
-        'retina-scan': load_medical_sample('retina-scan')
-    }
-    
-    if sample_id in samples:
-        return jsonify({'image': samples[sample_id]})
+    body = _SAMPLES_CACHE.get(sample_id)
+    if body is not None:
+        return Response(body, mimetype='application/json')
     else:
-        return jsonify({'error': 'Sample not found'}), 404
+        return json_response({'error': 'Sample not found'}, 404)
 
-def load_medical_sample(sample_id):
-    """Load a sample medical image as base64."""
+def draw_medical_sample(sample_id):
+    """Draw the noise-free canvas for a synthetic medical sample."""
     # In a real application, these would be actual medical images from a database or file system
     # For demonstration, we're creating synthetic medical-like images
     
@@ -143,10 +273,11 @@ def load_medical_sample(sample_id):
         
     elif sample_id == 'liver-ultrasound':
         # Create a liver ultrasound-like image
-        image = np.random.randint(10, 70, (height, width), dtype=np.uint8)
+        rng = np.random.default_rng()
+        image = rng.integers(10, 70, (height, width), dtype=np.uint8)
         mask = np.zeros((height, width), dtype=np.uint8)
         cv2.ellipse(mask, (width//2, height//2), (150, 120), 0, 0, 360, 255, -1)
-        liver = np.random.randint(80, 150, (height, width), dtype=np.uint8)
+        liver = rng.integers(80, 150, (height, width), dtype=np.uint8)
         image = np.where(mask > 0, liver, image)
         
     elif sample_id == 'retina-scan':
@@ -163,15 +294,29 @@ def load_medical_sample(sample_id):
             y2 = int(y1 + 180 * np.sin(angle))
             cv2.line(image, (x1, y1), (x2, y2), 150, 3)
             
-    # Add some noise
-    noise = np.random.normal(0, 15, (height, width)).astype(np.int8)
-    image = cv2.add(image, noise)
+    return image
+
+def load_medical_sample(sample_id):
+    """Load a sample medical image as base64."""
+    image = draw_medical_sample(sample_id)
+    
+    # Add some noise, generated straight into an int16 buffer and added
+    # in-place with saturation to uint8
+    noise = np.empty(image.shape, dtype=np.int16)
+    cv2.randn(noise, 0, 15)
+    cv2.add(image, noise, dst=image, dtype=cv2.CV_8U)
     
     # Convert to base64
     _, buffer = cv2.imencode('.png', image)
-    image_base64 = base64.b64encode(buffer).decode('utf-8')
-    
-    return f'data:image/png;base64,{image_base64}'
+    return DATA_URL_PNG + pybase64.b64encode_as_string(buffer.tobytes())
+
+# Sample images are generated once at import and served as ready-made
+# JSON response bodies
+_SAMPLES_CACHE = {
+    sample['id']: orjson.dumps({'image': load_medical_sample(sample['id'])})
+    for sample in MEDICAL_SAMPLES
+}
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    # Development server only; use gunicorn with gunicorn_conf.py in production
+    app.run(port=5000)
@@ -0,0 +1,23 @@
+import os
+
+# Gunicorn settings for serving contour_server in production:
+#   gunicorn -c gunicorn_conf.py contour_server:app
+
+bind = '127.0.0.1:5000'
+workers = os.cpu_count() or 1
+
+# Request threads per worker; contour_server reads the same variable to size
+# its per-worker encode pool (CONTOUR_THREADS * 6 threads)
+threads = int(os.environ.get('CONTOUR_THREADS', 4))
+worker_class = 'gthread'
+
+# Load the app before forking so the pre-generated sample responses are
+# shared copy-on-write between workers
+preload_app = True
+
+def post_fork(server, worker):
+    # Parallelism comes from workers, request threads and the encode pool;
+    # keep OpenCV from starting its own per-core thread pool in every worker
+    # on top of them
+    import cv2
+    cv2.setNumThreads(1)
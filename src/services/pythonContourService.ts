@@ -1,17 +1,17 @@
 // Service to communicate with the Python contour detection backend
 
-export interface ContourPoint {
-  x: number;
-  y: number;
-}
+// Contour points are sent as [x, y] pairs
+export type ContourPoint = [x: number, y: number];
 
+// All contours packed together; contour i spans
+// points[offsets[i]] up to (but not including) points[offsets[i + 1]]
 export interface ContourData {
+  offsets: number[];
   points: ContourPoint[];
-  closed: boolean;
 }
 
 export interface ContourResponse {
-  contours: ContourData[];
+  contours: ContourData;
   count: number;
   visualizations: {
     original: string;
@@ -216,7 +216,7 @@ class PythonContourService {
         
         // Return the simulated contour data
         resolve({
-          contours: [], // We're not actually computing real contours in the fallback
+          contours: { offsets: [0], points: [] }, // We're not actually computing real contours in the fallback
           count: 0,
           visualizations: {
             original: original,
@@ -238,7 +238,7 @@ class PythonContourService {
   
   private getEmptyResponse(imageData: string): ContourResponse {
     return {
-      contours: [],
+      contours: { offsets: [0], points: [] },
       count: 0,
       visualizations: {
         original: imageData,